@@ -7,6 +7,7 @@
 #   - Supports negative prompt by setting a prompt with negative weight
 #   - Supports sending key to machines on local network over HTTP (not HTTPS)
 
+import functools
 import io
 import logging
 import mimetypes
@@ -15,16 +16,37 @@ import pathlib
 import random
 import signal
 import sys
+import threading
 import time
-import uuid
+import weakref
 from argparse import ArgumentParser, BooleanOptionalAction, Namespace
-from typing import Any, Dict, Generator, List, Literal, Optional, Sequence, Tuple, Union
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from queue import Queue
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    Generator,
+    Iterable,
+    List,
+    Literal,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    TypeVar,
+    Union,
+)
 
 import grpc
-import torch
-from google.protobuf.json_format import MessageToJson
-from PIL import Image, ImageOps
-from safetensors.torch import safe_open
+
+# PIL and torch (via the safetensors serialization) are slow to import, so they're
+# only imported by the functions that need them. Just used for type hints here.
+if TYPE_CHECKING:
+    from PIL import Image
 
 try:
     from dotenv import load_dotenv
@@ -44,12 +66,11 @@ import generation_pb2 as generation
 import generation_pb2_grpc as generation_grpc
 import tensors_pb2 as tensors
 
-from gyre.protobuf_safetensors import serialize_safetensor
-from gyre.protobuf_tensors import serialize_tensor
-
 logger = logging.getLogger(__name__)
 logger.setLevel(level=logging.INFO)
 
+T = TypeVar("T")
+
 SAMPLERS: Dict[str, int] = {
     "ddim": generation.SAMPLER_DDIM,
     "plms": generation.SAMPLER_DDPM,
@@ -75,24 +96,29 @@ NOISE_TYPES: Dict[str, int] = {
 }
 
 
+def normalise_choice(s: str) -> str:
+    return s.lower().strip()
+
+
+@functools.cache
 def get_sampler_from_str(s: str) -> generation.DiffusionSampler:
     """
-    Convert a string to a DiffusionSampler enum.
+    Convert a string to a DiffusionSampler enum. Results are memoised by the
+    exact string passed, so repeated lookups don't re-normalise it.
 
     :param s: The string to convert.
     :return: The DiffusionSampler enum.
     """
-    algorithm_key = s.lower().strip()
-    algorithm = SAMPLERS.get(algorithm_key, None)
+    algorithm = SAMPLERS.get(normalise_choice(s), None)
     if algorithm is None:
         raise ValueError(f"unknown sampler {s}")
 
     return algorithm
 
 
+@functools.cache
 def get_noise_type_from_str(s: str) -> generation.SamplerNoiseType:
-    noise_key = s.lower().strip()
-    noise_type = NOISE_TYPES.get(noise_key, None)
+    noise_type = NOISE_TYPES.get(normalise_choice(s), None)
 
     if noise_type is None:
         raise ValueError(f"unknown noise type {s}")
@@ -100,6 +126,96 @@ def get_noise_type_from_str(s: str) -> generation.SamplerNoiseType:
     return noise_type
 
 
+def new_id() -> str:
+    """
+    Generate a random identifier for a request or artifact.
+
+    The ids are opaque to the server, so this skips the UUID object and its
+    string formatting, and just hex encodes 128 random bits.
+    """
+    return os.urandom(16).hex()
+
+
+@functools.lru_cache(maxsize=32)
+def sampler_parameters_template(
+    cfg_scale: float,
+    eta: float | None = None,
+    noise_type: int | None = None,
+    churn: float | None = None,
+    churn_tmin: float | None = None,
+    churn_tmax: float | None = None,
+    sigma_min: float | None = None,
+    sigma_max: float | None = None,
+    karras_rho: float | None = None,
+) -> generation.SamplerParameters:
+    """
+    Build the SamplerParameters for a request. These are usually identical between
+    requests (only the seed or prompt changes), so they're memoised.
+
+    The result is shared - don't modify it. Pass it to a message constructor or
+    CopyFrom, both of which copy it.
+    """
+    sampler_parameters: dict[str, Any] = dict(cfg_scale=cfg_scale)
+
+    if eta:
+        sampler_parameters["eta"] = eta
+    if noise_type:
+        sampler_parameters["noise_type"] = noise_type
+
+    if churn:
+        churn_parameters = dict(churn=churn)
+
+        if churn_tmin:
+            churn_parameters["churn_tmin"] = churn_tmin
+        if churn_tmax:
+            churn_parameters["churn_tmax"] = churn_tmax
+
+        sampler_parameters["churn"] = generation.ChurnSettings(**churn_parameters)
+
+    sigma_parameters = {}
+
+    if sigma_min:
+        sigma_parameters["sigma_min"] = sigma_min
+    if sigma_max:
+        sigma_parameters["sigma_max"] = sigma_max
+    if karras_rho:
+        sigma_parameters["karras_rho"] = karras_rho
+
+    sampler_parameters["sigma"] = generation.SigmaParameters(**sigma_parameters)
+
+    return generation.SamplerParameters(**sampler_parameters)
+
+
+def prefetch(iterable: Iterable[T], n: int = 2) -> Generator[T, None, None]:
+    """
+    Iterate over iterable in a background thread, keeping up to n items ready, so
+    that slow work done on each item doesn't hold up producing the next one.
+    Exceptions raised by iterable are re-raised in the consuming thread.
+    """
+    queue: Queue = Queue(maxsize=n)
+    done = object()
+
+    def produce():
+        try:
+            for item in iterable:
+                queue.put((item, None))
+        except BaseException as e:
+            queue.put((done, e))
+        else:
+            queue.put((done, None))
+
+    threading.Thread(target=produce, daemon=True).start()
+
+    while True:
+        item, error = queue.get()
+        if item is done:
+            break
+        yield item
+
+    if error is not None:
+        raise error
+
+
 def open_images(
     images: Union[
         Sequence[Tuple[str, generation.Artifact]],
@@ -125,37 +241,139 @@ def open_images(
         yield [path, artifact]
 
 
+def is_high_bit_depth(im) -> bool:
+    return im.mode in ("I", "F") or im.mode.startswith("I;16")
+
+
+def image_to_pixels(im, tensor: Optional[tensors.Tensor] = None) -> tensors.Tensor:
+    """
+    Convert a PIL image to a uint8 HWC Tensor of its raw pixels. High bit depth
+    images (I, I;16 and F modes) aren't supported.
+
+    Uses the raw encoder directly rather than Image.tobytes, so the pixels
+    are produced as a single bytes object without an intermediate join.
+
+    :param tensor: If passed, the Tensor message to fill in place (and return)
+        rather than creating a new one.
+    """
+    from PIL import Image
+
+    if is_high_bit_depth(im):
+        raise ValueError(f"can't convert {im.mode} image to 8 bit pixels losslessly")
+
+    if im.mode not in ("L", "LA", "RGB", "RGBA"):
+        im = im.convert("L" if im.mode == "1" else "RGBA")
+
+    im.load()
+    bands = len(im.getbands())
+
+    encoder = Image._getencoder(im.mode, "raw", im.mode)
+    encoder.setimage(im.im, (0, 0) + im.size)
+
+    # The raw encoder writes into a buffer of the size asked for, so asking for
+    # exactly the image size encodes all the pixels in one call, into one bytes
+    _, status, data = encoder.encode(im.width * im.height * bands)
+    if status != 1:
+        raise RuntimeError(f"encoder error {status} when converting image to pixels")
+
+    if tensor is None:
+        tensor = tensors.Tensor()
+
+    tensor.dtype = tensors.DT_UINT8
+    tensor.shape[:] = [im.height, im.width, bands]
+    tensor.data = data
+
+    return tensor
+
+
+# A PIL image, or the path to an image file (only read when the request is built)
+ImageSource = Union["Image.Image", str, os.PathLike]
+
+# Image files with these signatures can be sent as-is, the server decodes them natively
+PASSTHROUGH_IMAGE_SIGNATURES: Dict[bytes, str] = {
+    b"\x89PNG\r\n\x1a\n": "image/png",
+    b"\xff\xd8\xff": "image/jpeg",
+}
+
+
+def passthrough_image_mime(data: bytes) -> Optional[str]:
+    for signature, mime in PASSTHROUGH_IMAGE_SIGNATURES.items():
+        if data.startswith(signature):
+            return mime
+
+    return None
+
+
 def image_to_prompt(
-    im, init: bool = False, mask: bool = False, depth: bool = False, use_alpha=False
+    im: ImageSource,
+    init: bool = False,
+    mask: bool = False,
+    depth: bool = False,
+    use_alpha=False,
+    format: Literal["raw", "png"] = "png",
 ) -> generation.Prompt:
+    """
+    Convert a PIL image, or the path to an image file, to an artifact Prompt.
+
+    :param format: "png" (the default) sends a fast-compressed PNG, which any
+        server accepts. "raw" sends the pixels uncompressed as a tensor, which
+        avoids PNG encoding but needs a server that accepts tensor image artifacts.
+        PNG and JPEG files passed by path are always sent as-is.
+    """
     if init and mask:
         raise ValueError("init and mask cannot both be True")
 
+    type = generation.ARTIFACT_IMAGE
+    if mask:
+        type = generation.ARTIFACT_MASK
+    if depth:
+        type = generation.ARTIFACT_DEPTH
+
+    # Build the image data directly inside the Prompt - passing a nested message
+    # to a constructor copies it, which for image data is megabytes per level
+    prompt = generation.Prompt(parameters=generation.PromptParameters(init=init))
+    prompt.artifact.type = type
+    prompt.artifact.uuid = new_id()
+
+    if isinstance(im, (str, os.PathLike)):
+        with open(im, "rb") as f:
+            data = f.read()
+
+        mime = None if use_alpha else passthrough_image_mime(data)
+        if mime:
+            prompt.artifact.mime = mime
+            prompt.artifact.binary = data
+            return prompt
+
+        from PIL import Image
+
+        im = Image.open(io.BytesIO(data))
+
     if use_alpha:
+        from PIL import Image, ImageOps
+
         # Split into 3 channels
         r, g, b, a = im.split()
         # Recombine back to RGB image
         im = Image.merge("RGB", (a, a, a))
         im = ImageOps.invert(im)
 
-    buf = io.BytesIO()
-    im.save(buf, format="PNG")
-    buf.seek(0)
-
-    artifact_uuid = str(uuid.uuid4())
-
-    type = generation.ARTIFACT_IMAGE
-    if mask:
-        type = generation.ARTIFACT_MASK
-    if depth:
-        type = generation.ARTIFACT_DEPTH
+    # Raw pixels are 8 bit, so send high bit depth images (like 16 bit depth
+    # maps) as PNG rather than clipping them
+    if format == "raw" and is_high_bit_depth(im):
+        format = "png"
+
+    if format == "raw":
+        image_to_pixels(im, prompt.artifact.tensor)
+    elif format == "png":
+        # PNG compression is expensive, and it's just going over the wire
+        buf = io.BytesIO()
+        im.save(buf, format="PNG", compress_level=1, optimize=False)
+        prompt.artifact.binary = buf.getvalue()
+    else:
+        raise ValueError(f"unknown image format {format}")
 
-    return generation.Prompt(
-        artifact=generation.Artifact(
-            type=type, uuid=artifact_uuid, binary=buf.getvalue()
-        ),
-        parameters=generation.PromptParameters(init=init),
-    )
+    return prompt
 
 
 def ref_to_prompt(ref_uuid, mask: bool = False, depth: bool = False):
@@ -176,9 +394,14 @@ def ref_to_prompt(ref_uuid, mask: bool = False, depth: bool = False):
 
 
 def lora_to_prompt(path, weights):
-    safetensors = safe_open(path, framework="pt", device="cpu")
+    # As with image_to_prompt, build the tensors in place to avoid nested copies
+    prompt = generation.Prompt()
+    prompt.artifact.type = generation.ARTIFACT_LORA
 
-    lora = generation.Lora(lora=serialize_safetensor(safetensors))
+    lora = prompt.artifact.lora
+    from gyre.protobuf_safetensors import serialize_safetensor_mmap
+
+    serialize_safetensor_mmap(path, lora.lora)
 
     if weights:
         lora.weights.append(
@@ -190,12 +413,141 @@ def lora_to_prompt(path, weights):
             generation.LoraWeight(model_name="text_encoder", weight=weights.pop(0))
         )
 
-    return generation.Prompt(
-        artifact=generation.Artifact(
-            type=generation.ARTIFACT_LORA,
-            lora=lora,
-        ),
-    )
+    return prompt
+
+
+def _varint(value: int) -> bytes:
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+class RequestWithPrompts:
+    """
+    A Request whose prompts are held as separate messages until serialization.
+
+    Passing prompts to the Request constructor copies every one of them, including
+    any image or LoRA payloads, before gRPC then serializes the result. This instead
+    writes each prompt's wire encoding as its own chunk and joins them once (sized
+    up front by join) after the rest of the Request.
+
+    The prompts end up after the other fields rather than in field number order,
+    so the bytes differ from Request.SerializeToString, but parse to the same message.
+    """
+
+    _prompt_tag = _varint((generation.Request.PROMPT_FIELD_NUMBER << 3) | 2)
+
+    def __init__(self, request: generation.Request, prompts: List[generation.Prompt]):
+        self.request = request
+        self.prompts = prompts
+
+    def SerializeToString(self) -> bytes:
+        chunks = [self.request.SerializeToString()]
+        for prompt in self.prompts:
+            data = prompt.SerializeToString()
+            chunks += [self._prompt_tag, _varint(len(data)), data]
+        return b"".join(chunks)
+
+
+def generation_method_path(name: str) -> str:
+    service = generation.DESCRIPTOR.services_by_name["GenerationService"]
+    return f"/{service.full_name}/{service.methods_by_name[name].name}"
+
+
+class RequestWithIds:
+    """
+    A Request with its engine_id and / or request_id replaced for a single send,
+    without modifying (or copying) the Request itself.
+
+    Protobuf parsers keep the last value seen for a singular field, so the ids are
+    written again after the wrapped Request's own encoding.
+    """
+
+    _engine_id_tag = _varint((generation.Request.ENGINE_ID_FIELD_NUMBER << 3) | 2)
+    _request_id_tag = _varint((generation.Request.REQUEST_ID_FIELD_NUMBER << 3) | 2)
+
+    def __init__(
+        self,
+        request: Union[generation.Request, RequestWithPrompts],
+        engine_id: Optional[str] = None,
+        request_id: Optional[str] = None,
+    ):
+        self.request = request
+        self.engine_id = engine_id
+        self.request_id = request_id
+
+    def SerializeToString(self) -> bytes:
+        chunks = [self.request.SerializeToString()]
+        for tag, value in (
+            (self._engine_id_tag, self.engine_id),
+            (self._request_id_tag, self.request_id),
+        ):
+            if value is not None:
+                data = value.encode("utf-8")
+                chunks += [tag, _varint(len(data)), data]
+        return b"".join(chunks)
+
+
+def serialize_request(
+    request: Union[generation.Request, RequestWithPrompts, RequestWithIds]
+) -> bytes:
+    return request.SerializeToString()
+
+
+MIME_EXTENSIONS: Dict[str, str] = {
+    "image/png": ".png",
+    "image/jpeg": ".jpg",
+    "image/webp": ".webp",
+}
+
+
+@functools.lru_cache(maxsize=64)
+def extension_for_mime(mime: str) -> Optional[str]:
+    """
+    Convert a mime type to a file extension. Checks the common image types
+    first, to avoid initialising the whole mimetypes registry in most cases
+    """
+    ext = MIME_EXTENSIONS.get(mime)
+    return ext if ext else mimetypes.guess_extension(mime)
+
+
+def artifact_to_json(message) -> bytes:
+    # Compact (no indent) JSON is significantly cheaper to produce
+    from google.protobuf.json_format import MessageToJson
+
+    return MessageToJson(
+        message, preserving_proto_field_name=True, ensure_ascii=False, indent=None
+    ).encode("utf-8")
+
+
+def write_file(path: str, contents: bytes):
+    """
+    Write contents to path with unbuffered os-level writes, so the data is
+    copied straight to the kernel rather than through a Python buffer first
+    """
+    # O_BINARY only exists (and is only needed) on Windows
+    flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0)
+
+    # Same permissions as open() would use, so the umask still decides
+    fd = os.open(path, flags, 0o666)
+    try:
+        view = memoryview(contents)
+        while view:
+            view = view[os.write(fd, view) :]
+    finally:
+        os.close(fd)
+
+
+def write_artifact(out_p: str, contents: bytes, artifact, verbose: bool = False):
+    write_file(out_p, contents)
+    if verbose:
+        artifact_t = generation.ArtifactType.Name(artifact.type)
+        logger.info(f"wrote {artifact_t} to {out_p}")
+        if artifact.finish_reason == generation.FILTER:
+            logger.info(f"{artifact_t} flagged as NSFW")
 
 
 def process_artifacts_from_answers(
@@ -205,48 +557,87 @@ def process_artifacts_from_answers(
     ],
     write: bool = True,
     verbose: bool = False,
+    json: bool = False,
+    max_workers: int = 2,
+    max_pending_writes: int = 8,
 ) -> Generator[Tuple[str, generation.Artifact], None, None]:
     """
     Process the Artifacts from the Answers.
 
+    Artifacts are written to disk on background threads, so receiving the next
+    Answer isn't blocked on disk IO. All writes have finished by the time the
+    Generator is exhausted or closed.
+
     :param prefix: The prefix for the artifact filenames.
     :param answers: The Answers to process.
     :param write: Whether to write the artifacts to disk.
     :param verbose: Whether to print the artifact filenames.
+    :param json: Whether to write classifier & text artifacts as JSON rather than
+        as binary protobuf.
+    :param max_workers: How many threads to write artifacts on.
+    :param max_pending_writes: How many artifacts can be waiting to be written
+        before processing blocks, to cap memory use.
     :return: A Generator of tuples of artifact filenames and Artifacts, intended
         for passthrough.
     """
-    idx = 0
-    for resp in answers:
-        for artifact in resp.artifacts:
-            artifact_p = f"{prefix}-{resp.request_id}-{resp.answer_id}-{idx}"
-            if artifact.type == generation.ARTIFACT_IMAGE:
-                ext = mimetypes.guess_extension(artifact.mime)
-                contents = artifact.binary
-            elif artifact.type == generation.ARTIFACT_CLASSIFICATIONS:
-                ext = ".pb.json"
-                contents = MessageToJson(artifact.classifier).encode("utf-8")
-            elif artifact.type == generation.ARTIFACT_TEXT:
-                ext = ".pb.json"
-                contents = MessageToJson(artifact).encode("utf-8")
-            else:
-                ext = ".pb"
-                contents = artifact.SerializeToString()
-            out_p = f"{artifact_p}{ext}"
-            if write:
-                with open(out_p, "wb") as f:
-                    f.write(bytes(contents))
-                    if verbose:
-                        artifact_t = generation.ArtifactType.Name(artifact.type)
-                        logger.info(f"wrote {artifact_t} to {out_p}")
-                        if artifact.finish_reason == generation.FILTER:
-                            logger.info(f"{artifact_t} flagged as NSFW")
-
-            yield [out_p, artifact]
-            idx += 1
+    pending: Deque[Future] = deque()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        idx = 0
+        for resp in answers:
+            for artifact in resp.artifacts:
+                artifact_p = f"{prefix}-{resp.request_id}-{resp.answer_id}-{idx}"
+                if artifact.type == generation.ARTIFACT_IMAGE:
+                    ext = extension_for_mime(artifact.mime)
+                    contents = artifact.binary
+                elif json and artifact.type == generation.ARTIFACT_CLASSIFICATIONS:
+                    ext = ".pb.json"
+                    contents = artifact_to_json(artifact.classifier)
+                elif json and artifact.type == generation.ARTIFACT_TEXT:
+                    ext = ".pb.json"
+                    contents = artifact_to_json(artifact)
+                else:
+                    ext = ".pb"
+                    contents = artifact.SerializeToString()
+                out_p = f"{artifact_p}{ext}"
+                if write:
+                    while len(pending) >= max_pending_writes:
+                        pending.popleft().result()
+
+                    pending.append(
+                        executor.submit(
+                            write_artifact, out_p, contents, artifact, verbose
+                        )
+                    )
+
+                yield [out_p, artifact]
+                idx += 1
+
+        # Surface any errors from the remaining writes
+        while pending:
+            pending.popleft().result()
+
+
+# Bounds on the delay between AsyncResult polls that return no answers, in seconds
+ASYNC_POLL_MIN_DELAY = 0.25
+ASYNC_POLL_MAX_DELAY = 5.0
+# An empty AsyncResult that took at least this long means the server long-polled
+ASYNC_POLL_LONG_POLL_MIN = 1.0
 
 
 class StabilityInference:
+    # Channels opened by StabilityInference.shared, kept only while in use
+    _shared_channels: "weakref.WeakValueDictionary[tuple[str, str, str], Any]" = (
+        weakref.WeakValueDictionary()
+    )
+
+    # Cancels for every request currently in flight on any instance, called on
+    # ctrl-c. The SIGINT handler is installed once, by the first instance
+    _active_cancels: Set[Callable[[], Any]] = set()
+    _sigint_handler_installed = False
+    # Whatever SIGINT handler was installed before ours, called when nothing's active
+    _previous_sigint_handler: Any = None
+
     def __init__(
         self,
         host: str = "grpc.stability.ai:443",
@@ -255,6 +646,7 @@ class StabilityInference:
         engine: str = "stable-diffusion-v1-5",
         verbose: bool = False,
         wait_for_ready: bool = True,
+        channel: Any = None,
     ):
         """
         Initialize the client.
@@ -265,14 +657,73 @@ class StabilityInference:
         :param verbose: Whether to print debug messages.
         :param wait_for_ready: Whether to wait for the server to be ready, or
             to fail immediately.
+        :param channel: An already open channel to use, instead of opening a new
+            one to host.
         """
         self.verbose = verbose
         self.engine = engine
 
+        if (
+            not StabilityInference._sigint_handler_installed
+            and threading.current_thread() is threading.main_thread()
+        ):
+            StabilityInference._previous_sigint_handler = signal.signal(
+                signal.SIGINT, StabilityInference._handle_sigint
+            )
+            StabilityInference._sigint_handler_installed = True
+
         self.grpc_args = {}
         if proto == "grpc":
             self.grpc_args["wait_for_ready"] = wait_for_ready
 
+        if channel is None:
+            channel = self.open_channel(host, key, proto, verbose)
+
+        self.channel = channel
+        self.stub = generation_grpc.GenerationServiceStub(channel)
+        self.engine_stub = engines_grpc.EnginesServiceStub(channel)
+
+        # Versions of Generate & AsyncGenerate that also accept RequestWithPrompts
+        self.generate_call = channel.unary_stream(
+            generation_method_path("Generate"),
+            request_serializer=serialize_request,
+            response_deserializer=generation.Answer.FromString,
+        )
+        self.async_generate_call = channel.unary_unary(
+            generation_method_path("AsyncGenerate"),
+            request_serializer=serialize_request,
+            response_deserializer=generation.AsyncHandle.FromString,
+        )
+
+    @classmethod
+    def shared(
+        cls,
+        host: str = "grpc.stability.ai:443",
+        key: str = "",
+        proto: Literal["grpc", "grpc-web"] = "grpc",
+        **kwargs,
+    ) -> "StabilityInference":
+        """
+        Create a client that shares its channel with any other client created by
+        shared for the same host, key and proto, so the connection setup (and
+        TLS handshake) only happens once. Takes the same arguments as __init__.
+        """
+        channel_key = (host, key, proto)
+        channel = cls._shared_channels.get(channel_key)
+
+        if channel is None:
+            channel = cls.open_channel(host, key, proto, kwargs.get("verbose", False))
+            cls._shared_channels[channel_key] = channel
+
+        return cls(host, key, proto, channel=channel, **kwargs)
+
+    @staticmethod
+    def open_channel(
+        host: str,
+        key: str = "",
+        proto: Literal["grpc", "grpc-web"] = "grpc",
+        verbose: bool = False,
+    ):
         if verbose:
             logger.info(f"Opening channel to {host}")
 
@@ -282,6 +733,14 @@ class StabilityInference:
             ("grpc.max_message_length", maxMsgLength),
             ("grpc.max_send_message_length", maxMsgLength),
             ("grpc.max_receive_message_length", maxMsgLength),
+            # Ping during long running calls, so dead connections are noticed rather
+            # than waited on forever. Pings only happen while a call is active -
+            # idle channels aren't kept warm, since pinging without calls
+            # (keepalive_permit_without_calls) risks servers with a stricter ping
+            # policy closing the connection with too_many_pings. 5 minutes is the
+            # most often a default gRPC server will accept pings without data
+            ("grpc.keepalive_time_ms", 5 * 60 * 1000),
+            ("grpc.keepalive_timeout_ms", 20 * 1000),
         ]
 
         call_credentials = []
@@ -313,8 +772,26 @@ class StabilityInference:
 
         if verbose:
             logger.info(f"Channel opened to {host}")
-        self.stub = generation_grpc.GenerationServiceStub(channel)
-        self.engine_stub = engines_grpc.EnginesServiceStub(channel)
+
+        return channel
+
+    @staticmethod
+    def _handle_sigint(signum, frame):
+        cancels = list(StabilityInference._active_cancels)
+        if not cancels:
+            previous = StabilityInference._previous_sigint_handler
+            if previous is signal.SIG_IGN:
+                return
+            elif callable(previous):
+                return previous(signum, frame)
+            else:
+                # SIG_DFL, or a handler installed outside of Python
+                return signal.default_int_handler(signum, frame)
+
+        print("Cancelling")
+        for cancel in cancels:
+            cancel()
+        sys.exit(0)
 
     def list_engines(self):
         request = engines.ListEnginesRequest()
@@ -324,10 +801,10 @@ class StabilityInference:
         self,
         prompt: Union[str, List[str], generation.Prompt, List[generation.Prompt]],
         negative_prompt: str = None,
-        init_image: Optional[Image.Image] = None,
-        mask_image: Optional[Image.Image] = None,
+        init_image: Optional[ImageSource] = None,
+        mask_image: Optional[ImageSource] = None,
         mask_from_image_alpha: bool = False,
-        depth_image: Optional[Image.Image] = None,
+        depth_image: Optional[ImageSource] = None,
         depth_from_image: bool = False,
         height: int = 512,
         width: int = 512,
@@ -357,14 +834,16 @@ class StabilityInference:
         hires_oos_fraction: float | None = None,
         tiling: bool = False,
         lora: list[tuple[str, list[float]]] | None = None,
+        image_format: Literal["raw", "png"] = "png",
         as_async=False,
-    ) -> Generator[generation.Answer, None, None]:
+        wait: bool = True,
+    ) -> Union[Generator[generation.Answer, None, None], generation.AsyncHandle]:
         """
         Generate images from a prompt.
 
         :param prompt: Prompt to generate images from.
-        :param init_image: Init image.
-        :param mask_image: Mask image
+        :param init_image: Init image, as a PIL image or the path to an image file.
+        :param mask_image: Mask image, as a PIL image or the path to an image file.
         :param height: Height of the generated images.
         :param width: Width of the generated images.
         :param start_schedule: Start schedule for init image.
@@ -381,7 +860,12 @@ class StabilityInference:
         :param guidance_strength: Strength of the guidance. We recommend values in range [0.0,1.0]. A good default is 0.25
         :param guidance_prompt: Prompt to use for guidance, defaults to `prompt` argument (above) if not specified.
         :param guidance_models: Models to use for guidance.
-        :return: Generator of Answer objects.
+        :param image_format: How to send init, mask & depth images. See image_to_prompt.
+        :param as_async: Run the request asynchronously on the server.
+        :param wait: If as_async, whether to wait for and return the results, or
+            just submit the request and return its AsyncHandle.
+        :return: Generator of Answer objects, or an AsyncHandle if as_async and
+            not wait.
         """
         if (prompt is None) and (init_image is None):
             raise ValueError("prompt and/or init_image must be provided")
@@ -391,15 +875,14 @@ class StabilityInference:
                 "If mask_image is provided, init_image must also be provided"
             )
 
+        # The seed field copies from any iterable, so sequences are passed through as-is
         if not seed:
-            seed = [random.randrange(0, 4294967295)]
+            seed = (random.randrange(0, 4294967295),)
         elif isinstance(seed, int):
-            seed = [seed]
-        else:
-            seed = list(seed)
+            seed = (seed,)
 
         prompts: List[generation.Prompt] = []
-        if any(isinstance(prompt, t) for t in (str, generation.Prompt)):
+        if isinstance(prompt, (str, generation.Prompt)):
             prompt = [prompt]
         for p in prompt:
             if isinstance(p, str):
@@ -416,36 +899,19 @@ class StabilityInference:
                 )
             ]
 
-        sampler_parameters: dict[str, Any] = dict(cfg_scale=cfg_scale)
-
-        if eta:
-            sampler_parameters["eta"] = eta
-        if noise_type:
-            sampler_parameters["noise_type"] = noise_type
-
-        if churn:
-            churn_parameters = dict(churn=churn)
-
-            if churn_tmin:
-                churn_parameters["churn_tmin"] = churn_tmin
-            if churn_tmax:
-                churn_parameters["churn_tmax"] = churn_tmax
-
-            sampler_parameters["churn"] = generation.ChurnSettings(**churn_parameters)
-
-        sigma_parameters = {}
-
-        if sigma_min:
-            sigma_parameters["sigma_min"] = sigma_min
-        if sigma_max:
-            sigma_parameters["sigma_max"] = sigma_max
-        if karras_rho:
-            sigma_parameters["karras_rho"] = karras_rho
-
-        sampler_parameters["sigma"] = generation.SigmaParameters(**sigma_parameters)
-
         step_parameters = dict(
-            scaled_step=0, sampler=generation.SamplerParameters(**sampler_parameters)
+            scaled_step=0,
+            sampler=sampler_parameters_template(
+                cfg_scale=cfg_scale,
+                eta=eta,
+                noise_type=noise_type,
+                churn=churn,
+                churn_tmin=churn_tmin,
+                churn_tmax=churn_tmax,
+                sigma_min=sigma_min,
+                sigma_max=sigma_max,
+                karras_rho=karras_rho,
+            ),
         )
 
         # NB: Specifying schedule when there's no init image causes washed out results
@@ -454,11 +920,13 @@ class StabilityInference:
                 start=start_schedule,
                 end=end_schedule,
             )
-            init_image_prompt = image_to_prompt(init_image, init=True)
+            init_image_prompt = image_to_prompt(
+                init_image, init=True, format=image_format
+            )
             prompts += [init_image_prompt]
 
             if mask_image is not None:
-                prompts += [image_to_prompt(mask_image, mask=True)]
+                prompts += [image_to_prompt(mask_image, mask=True, format=image_format)]
 
             elif mask_from_image_alpha:
                 mask_prompt = ref_to_prompt(init_image_prompt.artifact.uuid, mask=True)
@@ -481,7 +949,9 @@ class StabilityInference:
                 prompts += [mask_prompt]
 
             if depth_image is not None:
-                prompts += [image_to_prompt(depth_image, depth=True)]
+                prompts += [
+                    image_to_prompt(depth_image, depth=True, format=image_format)
+                ]
 
             if depth_from_image:
                 depth_prompt = ref_to_prompt(
@@ -558,12 +1028,66 @@ class StabilityInference:
             tiling=tiling,
         )
 
-        if as_async:
-            return self.emit_async_request(
-                prompt=prompts, image_parameters=image_parameters
+        return self.generate_pb(
+            RequestWithPrompts(generation.Request(image=image_parameters), prompts),
+            as_async=as_async,
+            wait=wait,
+        )
+
+    def generate_pb(
+        self,
+        request: Union[generation.Request, RequestWithPrompts],
+        as_async: bool = False,
+        wait: bool = True,
+    ) -> Union[Generator[generation.Answer, None, None], generation.AsyncHandle]:
+        """
+        Send an already built Request, skipping all of generate's argument handling.
+        Useful when submitting many similar requests - build one, then change just
+        the fields that differ (like the seed) between calls.
+
+        :param request: The Request to send. If the engine_id isn't set, this
+            client's engine is used. If the request_id isn't set, a new one is
+            generated for each call. The passed Request is never modified.
+        :param as_async: Run the request asynchronously on the server.
+        :param wait: If as_async, whether to wait for and return the results, or
+            just submit the request and return its AsyncHandle.
+        :return: Generator of Answer objects, or an AsyncHandle if as_async and
+            not wait.
+        """
+        rq = request.request if isinstance(request, RequestWithPrompts) else request
+
+        if not rq.engine_id or not rq.request_id:
+            request = RequestWithIds(
+                request,
+                engine_id=None if rq.engine_id else self.engine,
+                request_id=None if rq.request_id else new_id(),
             )
+
+        if self.verbose:
+            logger.info("Sending request.")
+
+        if as_async and not wait:
+            return self.async_generate_call(request, **self.grpc_args)
+        elif as_async:
+            return self._async_request_answers(request)
         else:
-            return self.emit_request(prompt=prompts, image_parameters=image_parameters)
+            return self._request_answers(request)
+
+    def _build_request(
+        self,
+        prompt: generation.Prompt,
+        image_parameters: generation.ImageParameters,
+        engine_id: str = None,
+        request_id: str = None,
+    ) -> RequestWithPrompts:
+        return RequestWithPrompts(
+            generation.Request(
+                engine_id=engine_id,
+                request_id=request_id,
+                image=image_parameters,
+            ),
+            prompt,
+        )
 
     # The motivation here is to facilitate constructing requests by passing protobuf objects directly.
     def emit_request(
@@ -572,32 +1096,27 @@ class StabilityInference:
         image_parameters: generation.ImageParameters,
         engine_id: str = None,
         request_id: str = None,
-    ):
-        if not request_id:
-            request_id = str(uuid.uuid4())
-        if not engine_id:
-            engine_id = self.engine
-
-        rq = generation.Request(
-            engine_id=engine_id,
-            request_id=request_id,
-            prompt=prompt,
-            image=image_parameters,
+    ) -> Generator[generation.Answer, None, None]:
+        return self.generate_pb(
+            self._build_request(prompt, image_parameters, engine_id, request_id)
         )
 
-        if self.verbose:
-            logger.info("Sending request.")
-
+    def _request_answers(
+        self, rq: Union[generation.Request, RequestWithPrompts, RequestWithIds]
+    ) -> Generator[generation.Answer, None, None]:
         start = time.time()
-        answers = self.stub.Generate(rq, **self.grpc_args)
-
-        def cancel_request(unused_signum, unused_frame):
-            print("Cancelling")
-            answers.cancel()
-            sys.exit(0)
+        answers = self.generate_call(rq, **self.grpc_args)
 
-        signal.signal(signal.SIGINT, cancel_request)
+        cancel = answers.cancel
+        self._active_cancels.add(cancel)
+        try:
+            yield from self._log_answers(answers, start)
+        finally:
+            self._active_cancels.discard(cancel)
 
+    def _log_answers(
+        self, answers: Iterable[generation.Answer], start: float
+    ) -> Generator[generation.Answer, None, None]:
         for answer in answers:
             duration = time.time() - start
             if self.verbose:
@@ -619,49 +1138,106 @@ class StabilityInference:
             start = time.time()
 
     # The motivation here is to facilitate constructing requests by passing protobuf objects directly.
-    def emit_async_request(
+    def submit_async_request(
         self,
         prompt: generation.Prompt,
         image_parameters: generation.ImageParameters,
         engine_id: str = None,
         request_id: str = None,
-    ):
-        if not request_id:
-            request_id = str(uuid.uuid4())
-        if not engine_id:
-            engine_id = self.engine
-
-        rq = generation.Request(
-            engine_id=engine_id,
-            request_id=request_id,
-            prompt=prompt,
-            image=image_parameters,
+    ) -> generation.AsyncHandle:
+        return self.generate_pb(
+            self._build_request(prompt, image_parameters, engine_id, request_id),
+            as_async=True,
+            wait=False,
         )
 
-        if self.verbose:
-            logger.info("Sending request.")
-
-        start = time.time()
-        handle = self.stub.AsyncGenerate(rq, **self.grpc_args)
-
-        print(handle)
-
-        def cancel_request(unused_signum, unused_frame):
-            print("Cancelling")
-            self.stub.AsyncCancel(handle)
-            sys.exit(0)
+    def async_results(
+        self, handle: generation.AsyncHandle
+    ) -> Generator[generation.Answer, None, None]:
+        cancel = functools.partial(self.stub.AsyncCancel, handle)
+        self._active_cancels.add(cancel)
+        try:
+            # Gyre's AsyncResult long-polls (it waits server side until there's at
+            # least one answer or it times out), but other servers may return
+            # immediately. So only back off after empty polls that came back quickly
+            delay = 0.0
+
+            while True:
+                poll_start = time.monotonic()
+                answers = self.stub.AsyncResult(handle)
+                poll_duration = time.monotonic() - poll_start
+
+                for answer in answers.answer:
+                    yield answer
+
+                if answers.complete:
+                    print("Done")
+                    break
+
+                if answers.answer or poll_duration >= ASYNC_POLL_LONG_POLL_MIN:
+                    delay = 0.0
+                else:
+                    delay = min(
+                        max(delay * 2, ASYNC_POLL_MIN_DELAY), ASYNC_POLL_MAX_DELAY
+                    )
+                    time.sleep(delay)
+        finally:
+            self._active_cancels.discard(cancel)
 
-        signal.signal(signal.SIGINT, cancel_request)
+    # The motivation here is to facilitate constructing requests by passing protobuf objects directly.
+    def emit_async_request(
+        self,
+        prompt: generation.Prompt,
+        image_parameters: generation.ImageParameters,
+        engine_id: str = None,
+        request_id: str = None,
+    ) -> Generator[generation.Answer, None, None]:
+        return self.generate_pb(
+            self._build_request(prompt, image_parameters, engine_id, request_id),
+            as_async=True,
+        )
 
-        while True:
-            answers = self.stub.AsyncResult(handle)
-            for answer in answers.answer:
-                yield answer
+    def _async_request_answers(
+        self, rq: Union[generation.Request, RequestWithPrompts, RequestWithIds]
+    ) -> Generator[generation.Answer, None, None]:
+        handle = self.async_generate_call(rq, **self.grpc_args)
 
-            if answers.complete:
-                print("Done")
+        print(handle)
 
-            time.sleep(5)
+        yield from self.async_results(handle)
+
+
+# CLI arguments that are passed through to generate() unchanged
+_REQUEST_KEYS = frozenset(
+    [
+        "negative_prompt",
+        "height",
+        "width",
+        "start_schedule",
+        "end_schedule",
+        "cfg_scale",
+        "guidance_strength",
+        "eta",
+        "churn",
+        "churn_tmin",
+        "churn_tmax",
+        "sigma_min",
+        "sigma_max",
+        "karras_rho",
+        "steps",
+        "seed",
+        "init_image",
+        "mask_image",
+        "mask_from_image_alpha",
+        "depth_image",
+        "depth_from_image",
+        "hires_fix",
+        "hires_oos_fraction",
+        "tiling",
+        "image_format",
+        "as_async",
+    ]
+)
 
 
 if __name__ == "__main__":
@@ -721,7 +1297,9 @@ if __name__ == "__main__":
     parser.add_argument(
         "--sampler",
         "-A",
-        type=str,
+        type=normalise_choice,
+        choices=SAMPLERS.keys(),
+        metavar="SAMPLER",
         default="k_lms",
         help="[k_lms] (" + ", ".join(SAMPLERS.keys()) + ")",
     )
@@ -764,7 +1342,9 @@ if __name__ == "__main__":
     )
     parser.add_argument(
         "--noise_type",
-        type=str,
+        type=normalise_choice,
+        choices=NOISE_TYPES.keys(),
+        metavar="NOISE_TYPE",
         default="normal",
         help="[normal] (" + ", ".join(NOISE_TYPES.keys()) + ")",
     )
@@ -786,6 +1366,11 @@ if __name__ == "__main__":
         "--num_samples", "-n", type=int, default=1, help="number of samples to generate"
     )
     parser.add_argument("--show", action="store_true", help="open artifacts using PIL")
+    parser.add_argument(
+        "--json",
+        action="store_true",
+        help="write classifier and text artifacts as JSON rather than binary protobuf",
+    )
     parser.add_argument(
         "--engine",
         "-e",
@@ -796,13 +1381,13 @@ if __name__ == "__main__":
     parser.add_argument(
         "--init_image",
         "-i",
-        type=str,
+        type=pathlib.Path,
         help="Init image",
     )
     parser.add_argument(
         "--mask_image",
         "-m",
-        type=str,
+        type=pathlib.Path,
         help="Mask image",
     )
     parser.add_argument(
@@ -813,7 +1398,7 @@ if __name__ == "__main__":
     )
     parser.add_argument(
         "--depth_image",
-        type=str,
+        type=pathlib.Path,
         help="Depth image",
     )
     parser.add_argument(
@@ -821,6 +1406,13 @@ if __name__ == "__main__":
         action="store_true",
         help="Inference the depth from the image",
     )
+    parser.add_argument(
+        "--image_format",
+        type=str,
+        default="png",
+        choices=["raw", "png"],
+        help="[png] Send init, mask & depth images as PNG, or as raw pixels (for servers that accept raw)",
+    )
     parser.add_argument(
         "--negative_prompt",
         "-N",
@@ -858,7 +1450,16 @@ if __name__ == "__main__":
         action="store_true",
         help="Use GRPC-WEB to connect to the server (instead of GRPC)",
     )
-    parser.add_argument("--as_async", action="store_true", help="Run asyncronously")
+    parser.add_argument(
+        "--as_async",
+        action="store_true",
+        help="Run asyncronously - submit the request, print its handle and exit",
+    )
+    parser.add_argument(
+        "--async_handle",
+        type=str,
+        help="Fetch the results of a request previously submitted with --as_async",
+    )
     parser.add_argument("prompt", nargs="*")
     args = parser.parse_args()
 
@@ -874,22 +1475,13 @@ if __name__ == "__main__":
         stability_api.list_engines()
         sys.exit(0)
 
-    if not args.prompt and not args.init_image:
+    if not args.prompt and not args.init_image and not args.async_handle:
         logger.warning("prompt or init image must be provided")
         parser.print_help()
         sys.exit(1)
     else:
         args.prompt = " ".join(args.prompt)
 
-    if args.init_image:
-        args.init_image = Image.open(args.init_image)
-
-    if args.mask_image:
-        args.mask_image = Image.open(args.mask_image)
-
-    if args.depth_image:
-        args.depth_image = Image.open(args.depth_image)
-
     lora = []
     if args.lora:
         for path in args.lora:
@@ -897,45 +1489,47 @@ if __name__ == "__main__":
             weights = [float(weight) for weight in weights]
             lora.append((path, weights))
 
-    request = {
-        "negative_prompt": args.negative_prompt,
-        "height": args.height,
-        "width": args.width,
-        "start_schedule": args.start_schedule,
-        "end_schedule": args.end_schedule,
-        "cfg_scale": args.cfg_scale,
-        "guidance_strength": args.guidance_strength,
-        "sampler": get_sampler_from_str(args.sampler),
-        "eta": args.eta,
-        "churn": args.churn,
-        "churn_tmin": args.churn_tmin,
-        "churn_tmax": args.churn_tmax,
-        "sigma_min": args.sigma_min,
-        "sigma_max": args.sigma_max,
-        "karras_rho": args.karras_rho,
-        "noise_type": get_noise_type_from_str(args.noise_type),
-        "steps": args.steps,
-        "seed": args.seed,
-        "samples": args.num_samples,
-        "init_image": args.init_image,
-        "mask_image": args.mask_image,
-        "mask_from_image_alpha": args.mask_from_image_alpha,
-        "depth_image": args.depth_image,
-        "depth_from_image": args.depth_from_image,
-        "hires_fix": args.hires_fix,
-        "hires_oos_fraction": args.hires_oos_fraction,
-        "tiling": args.tiling,
-        "lora": lora,
-        "as_async": args.as_async,
-    }
-
-    answers = stability_api.generate(args.prompt, **request)
+    request = {key: getattr(args, key) for key in _REQUEST_KEYS}
+    request["sampler"] = SAMPLERS[args.sampler]
+    request["noise_type"] = NOISE_TYPES[args.noise_type]
+    request["samples"] = args.num_samples
+    request["lora"] = lora
+
+    if args.async_handle:
+        answers = stability_api.async_results(
+            generation.AsyncHandle(async_handle=args.async_handle)
+        )
+    elif args.as_async:
+        # Fire and forget - the results can be collected later with --async_handle
+        handle = stability_api.generate(args.prompt, **request, wait=False)
+        print(handle.async_handle)
+        sys.exit(0)
+    else:
+        answers = stability_api.generate(args.prompt, **request)
+
+    if args.no_store and not args.show:
+        # Nothing to write or show, so skip artifact processing entirely. The
+        # answers still need consuming though, or the request is never sent
+        deque(answers, maxlen=0)
+        sys.exit(0)
+
+    # One writer per sample (within reason), so a batch's images are all written
+    # in parallel while the next answers are still arriving
+    writers = min(8, max(1, args.num_samples))
+
     artifacts = process_artifacts_from_answers(
-        args.prefix, answers, write=not args.no_store, verbose=True
+        args.prefix,
+        answers,
+        write=not args.no_store,
+        verbose=True,
+        json=args.json,
+        max_workers=writers,
+        max_pending_writes=2 * writers,
     )
     if args.show:
-        for artifact in open_images(artifacts, verbose=True):
+        # Image.show launches the viewer without waiting for it, but still decodes
+        # and re-encodes each image, so keep receiving artifacts in the meantime
+        for artifact in open_images(prefetch(artifacts), verbose=True):
             pass
     else:
-        for artifact in artifacts:
-            pass
+        deque(artifacts, maxlen=0)
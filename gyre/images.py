@@ -61,6 +61,33 @@ def fromPngBytes(bytes):
     return asuint8[None, ...].to(torch.float32) / 255
 
 
+# Takes raw uint8 pixels in HW or HWC layout, returns RGBA like fromPngBytes does
+def fromPixelTensor(pixelsHWC):
+    if pixelsHWC.dtype != torch.uint8:
+        raise ValueError(f"Pixel tensors must be uint8, got {pixelsHWC.dtype}")
+
+    if pixelsHWC.ndim == 2:
+        pixelsHWC = pixelsHWC[..., None]
+
+    if pixelsHWC.ndim != 3 or not 1 <= pixelsHWC.shape[2] <= 4:
+        raise ValueError(
+            f"Pixel tensors must be HW or HWC with 1-4 channels, got shape {list(pixelsHWC.shape)}"
+        )
+
+    channels = pixelsHWC.shape[2]
+    if channels <= 2:
+        # Greyscale, optionally with alpha
+        pixelsHWC = pixelsHWC[..., [0, 0, 0, 1][: channels + 2]]
+
+    asuint8 = pixelsHWC.permute(2, 0, 1)
+
+    if asuint8.shape[0] == 3:
+        alpha = torch.full_like(asuint8[:1], 255)
+        asuint8 = torch.cat([asuint8, alpha], dim=0)
+
+    return asuint8[None, ...].to(torch.float32) / 255
+
+
 # Images with alpha will be slow for now. TODO: Move to OpenCV (torchvision does not support encoding alpha images)
 def toPngBytes(tensor):
     tensor = tensor.to("cpu")
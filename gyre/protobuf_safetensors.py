@@ -1,12 +1,20 @@
+import json
+import mmap
+import struct
+
+import tensors_pb2 as tensors_pb
+
 from gyre.generated.generation_pb2 import (
     Safetensors,
     SafetensorsMeta,
     SafetensorsTensor,
 )
-from gyre.protobuf_tensors import deserialize_tensor, serialize_tensor
 
 
 def serialize_safetensor(safetensors):
+    # Imported here as it needs torch, which serialize_safetensor_mmap doesn't
+    from gyre.protobuf_tensors import serialize_tensor
+
     proto_safetensors = Safetensors()
 
     for k, v in safetensors.metadata().items():
@@ -20,6 +28,63 @@ def serialize_safetensor(safetensors):
     return proto_safetensors
 
 
+# BF16 is deliberately missing - deserialize_tensor would read it back as float16
+SafetensorsDtypePbs = {
+    "F64": tensors_pb.DT_FLOAT64,
+    "F32": tensors_pb.DT_FLOAT32,
+    "F16": tensors_pb.DT_FLOAT16,
+    "I64": tensors_pb.DT_INT64,
+    "I32": tensors_pb.DT_INT32,
+    "I16": tensors_pb.DT_INT16,
+    "I8": tensors_pb.DT_INT8,
+    "U8": tensors_pb.DT_UINT8,
+    "BOOL": tensors_pb.DT_BOOL,
+}
+
+
+def serialize_safetensor_mmap(path, proto_safetensors=None):
+    """
+    Like serialize_safetensor, but reads the safetensors file at path directly
+
+    The file is mmap-ed and each tensor's bytes are sliced out of the mapping
+    into the protobuf, so the tensors never get materialised as torch tensors.
+    Each slice is still a copy (protobuf bytes fields don't accept memoryviews),
+    so the returned message holds all the tensor data in memory
+
+    If proto_safetensors is passed, it is filled in place rather than a new
+    Safetensors message being created. Tensors are always built in place,
+    since passing a message to a constructor or append copies it
+    """
+    if proto_safetensors is None:
+        proto_safetensors = Safetensors()
+
+    with open(path, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    with mm:
+        (header_len,) = struct.unpack("<Q", mm[:8])
+        header = json.loads(mm[8 : 8 + header_len])
+        data_start = 8 + header_len
+
+        for k, v in header.pop("__metadata__", {}).items():
+            proto_safetensors.metadata.append(SafetensorsMeta(key=k, value=v))
+
+        for k in sorted(header.keys()):
+            info = header[k]
+            begin, end = info["data_offsets"]
+
+            dtype = SafetensorsDtypePbs.get(info["dtype"])
+            if dtype is None:
+                raise ValueError(f"Unsupported safetensors dtype {info['dtype']}")
+
+            tensor = proto_safetensors.tensors.add(key=k).tensor
+            tensor.dtype = dtype
+            tensor.shape[:] = info["shape"]
+            tensor.data = mm[data_start + begin : data_start + end]
+
+    return proto_safetensors
+
+
 class FakeSafetensors:
     def __init__(self, metadata, tensors):
         self._metadata = metadata
@@ -36,6 +101,9 @@ class FakeSafetensors:
 
 
 def deserialize_safetensors(proto_safetensors):
+    # Imported here as it needs torch, which serialize_safetensor_mmap doesn't
+    from gyre.protobuf_tensors import deserialize_tensor
+
     metadata = {}
     tensors = {}
 
@@ -13,6 +13,7 @@ from typing import Callable, Iterable
 import generation_pb2
 import generation_pb2_grpc
 import grpc
+import tensors_pb2
 import torch
 from google.protobuf import json_format as pb_json_format
 
@@ -215,6 +216,21 @@ class ParameterExtractor:
     def _image_from_artifact_binary(self, artifact):
         return images.fromPngBytes(artifact.binary).to(self._manager.mode.device)
 
+    def _image_from_artifact_tensor(self, artifact):
+        shape = artifact.tensor.shape
+        if artifact.tensor.dtype != tensors_pb2.DT_UINT8:
+            raise ValueError(
+                "Image tensors must be uint8, got "
+                + tensors_pb2.Dtype.Name(artifact.tensor.dtype)
+            )
+        if len(shape) not in (2, 3) or (len(shape) == 3 and not 1 <= shape[2] <= 4):
+            raise ValueError(
+                f"Image tensors must be HW or HWC with 1-4 channels, got shape {list(shape)}"
+            )
+
+        pixels = deserialize_tensor(artifact.tensor)
+        return images.fromPixelTensor(pixels).to(self._manager.mode.device)
+
     def _image_from_artifact_reference(self, artifact):
         if artifact.ref.WhichOneof("reference") == "id":
             test = lambda x: x.id == artifact.ref.id
@@ -232,6 +248,8 @@ class ParameterExtractor:
     ):
         if artifact.WhichOneof("data") == "binary":
             image = self._image_from_artifact_binary(artifact)
+        elif artifact.WhichOneof("data") == "tensor":
+            image = self._image_from_artifact_tensor(artifact)
         elif artifact.WhichOneof("data") == "ref":
             image = self._image_from_artifact_reference(artifact)
         else:
@@ -680,8 +698,10 @@ class GenerationServiceServicer(generation_pb2_grpc.GenerationServiceServicer):
         async_answer = generation_pb2.AsyncAnswer(complete=False)
 
         try:
+            # Block until the first answer arrives (so clients can poll without
+            # sleeping), then return it along with anything else already queued
+            answer = async_context.queue.get(timeout=2)
             while True:
-                answer = async_context.queue.get(timeout=2)
                 if answer == "DONE":
                     async_answer.complete = True
                     async_answer.status.code = async_context.code
@@ -689,6 +709,7 @@ class GenerationServiceServicer(generation_pb2_grpc.GenerationServiceServicer):
                     break
                 else:
                     async_answer.answer.append(answer)
+                answer = async_context.queue.get_nowait()
         except Empty:
             pass
 